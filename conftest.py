@@ -0,0 +1,19 @@
+import os
+import shutil
+import tempfile
+
+'''
+The tests and doctests, and the rstdcx processes they start,
+keep the rstdoc cache in a temporary folder, not in the user's.
+'''
+
+_cache_home = None
+
+def pytest_configure(config):
+    global _cache_home
+    _cache_home = tempfile.mkdtemp(prefix='rstdoc-test-cache-')
+    os.environ['XDG_CACHE_HOME'] = _cache_home
+    os.environ['LOCALAPPDATA'] = _cache_home
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_cache_home, ignore_errors=True)
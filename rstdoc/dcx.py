@@ -20,20 +20,32 @@
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-from collections import OrderedDict, defaultdict
 from hashlib import sha1 as sha
+from hashlib import blake2b
 from binascii import b2a_base64
 import pyx
 import stpl
 from docutils.core import publish_file, publish_string
 from argparse import Namespace
-from types import GeneratorType
-from itertools import tee
 from functools import lru_cache, wraps, partial, reduce
+from itertools import compress, count
+try:
+    from itertools import pairwise
+except ImportError:  # python < 3.10
+    from itertools import tee
+
+    def pairwise(iterable):
+        a, b = tee(iterable)
+        next(b, None)
+        return zip(a, b)
+from bisect import bisect_right
 from urllib import request
-from threading import RLock
+from threading import RLock, local
 import tempfile
 import subprocess as sp
+import json
+import mmap
+import time
 import atexit
 import contextlib
 import shutil
@@ -41,7 +53,6 @@ import os, os.path
 import io
 import re
 import sys
-import codecs
 import numpy as np
 from rstdoc import __version__
 
@@ -325,6 +336,21 @@ def opnappend(filename):
 def opn(filename):
     return open(filename, encoding='utf-8')
 
+def _write_if_changed(filename, text):
+    # like opnwrite(), but an unchanged file keeps its modification time,
+    # which would otherwise trigger rebuilds downstream
+    data = text.encode('utf-8')
+    try:
+        with open(filename, 'rb') as f:
+            if f.read() == data:
+                return False
+    except OSError:
+        pass
+    # in place, like opnwrite(): a symbolic link and the mode stay
+    with open(filename, 'wb') as f:
+        f.write(data)
+    return True
+
 
 isfile = os.path.isfile
 isdir = os.path.isdir
@@ -497,10 +523,21 @@ rextgt = re.compile(
 rexsubtgt = re.compile(
     r'(?:^|^[^\.\%\w]*\s|^\s*\(?\w+[\)\.]\s)\.\. \|(\w[^\|]*)\|\s\w+::')
 
+
+def _tgt_names(lns):
+    # {line index: target name} for the rextgt lines in lns
+    # '.. _' is in every rextgt match: most lines skip the regex
+    search = rextgt.search
+    return {i: m.group(1) for i, ln in enumerate(lns)
+            if '.. _' in ln for m in (search(ln),) if m}
+
+
 rextitle = re.compile(r'^([!"#$%&\'()*+,\-./:;<=>?@[\]^_`{|}~])\1+$')
 #rextitle.match('===')
 #rextitle.match('==')
 #rextitle.match('=') #NO
+# first characters rextitle can match: checked before calling rextitle
+_title_punct = frozenset('!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~')
 
 rexitem = re.compile(r'^\s*:?\**(\w[^:\*]*)\**:\s*.*$')
 #rexitem.match(":linkname: words").groups()[0]
@@ -509,11 +546,22 @@ rexitem = re.compile(r'^\s*:?\**(\w[^:\*]*)\**:\s*.*$')
 #rexitem.match("``a`` linkname: words") #NO
 
 rexoneword = re.compile(r'^\s*(\w+)\s*$')
+rexwordchar = re.compile(r'\w')
 rexname = re.compile(r'^\s*:name:\s*(\w.*)*$')
 rexlnks = re.compile(r'(?:^|[^a-zA-Z`])\|(\w+)\|(?:$|[^a-zA-Z`])')
 reximg = re.compile(r'(?:image|figure):: ((?:\.|/|\\|\w).*)')
 rerstinclude = re.compile(r'\.\. include::\s*([\./\w\\].*)')
 restplinclude = re.compile(r"""%\s*include\s*\(\s*["']([^'"]+)['"].*\)\s*""")
+# rerstinclude at the line start or reximg, in one search
+rexincimg = re.compile(r'^\s*\.\. include::\s*(?P<inc>[\./\w\\].*)'
+                       r'|(?:image|figure):: (?P<img>(?:\.|/|\\|\w).*)')
+#rexincimg.search('  .. include:: ../some.rst').lastgroup == 'inc'
+#rexincimg.search('  .. |x y| image:: some.png').lastgroup == 'img'
+rexincludelinks = re.compile(r'^\.\. include:: (.*)(_links_sphinx)(.re?st)')
+rexgen = re.compile(r'#\s*def gen(\w*(lns,\*\*kw):)*')
+# rexgen.search('# def gen(lns,**kw):') #begin
+# rexgen.search('# def gen') #end
+rexgensplit = re.compile(r'#\s*def |:')
 
 #... combined:
 cmmnt = r"""[\.:#%/';"-]"""
@@ -649,6 +697,8 @@ rst_opts = {  # http://docutils.sourceforge.net/docs/user/config.html
 }
 
 # ``list-table`` and ``code-block`` are converted to ``table`` and ``code``
+_counted_directive_alias = {'.. list-table': '.. table',
+                            '.. code-block': '.. code'}
 
 
 def make_counters():
@@ -1375,7 +1425,7 @@ def PageBreakHack(destination_path):
     '''
 
     from zipfile import ZipFile
-    odtzip = OrderedDict()
+    odtzip = {}
     with ZipFile(destination_path) as z:
         for n in z.namelist():
             with z.open(n) as f:
@@ -1736,6 +1786,36 @@ def pngembed(
         return ".. image:: {}".format(pngfn)
 
 
+def _no_escape(x):
+    return x
+
+
+class _StplTemplate(stpl.SimpleTemplate):
+    # included templates are taken from _stpl_template(), too
+    def _include(self, _env, _name=None, **kwargs):
+        self.cache[_name] = _stpl_template(
+            None, _name, tuple(self.lookup), stpl.html_escape)
+        return super()._include(_env, _name, **kwargs)
+
+
+@lru_cache(maxsize=128)
+def _stpl_template_cached(source, name, lookup, escape_func, mtime_ns):
+    return _StplTemplate(
+        source=source, name=name, lookup=lookup, escape_func=escape_func)
+
+
+def _stpl_template(source, name, lookup, escape_func):
+    # the compiled template is reused as long as its file is unchanged
+    mtime_ns = None
+    if name:
+        try:
+            mtime_ns = os.stat(
+                _StplTemplate.search(name, lookup)).st_mtime_ns
+        except:
+            pass
+    return _stpl_template_cached(source, name, lookup, escape_func, mtime_ns)
+
+
 @infile_cwd
 def dostpl(
         infile,
@@ -1756,7 +1836,8 @@ def dostpl(
 
     :param infile: a .stpl file name or list of lines
     :param outfile: if not provided the expanded is returned
-    :param lookup: lookup paths can be absolute or relative to infile
+    :param lookup: lookup paths can be absolute or relative to infile;
+        the directory of infile is searched last
 
     ::
 
@@ -1772,6 +1853,9 @@ def dostpl(
         lookup = [abspath(normjoin(dirname(infile), x)) for x in lookup if not isabs(x)
                   ]+[x for x in lookup if isabs(x)]
         filename = abspath(infile)
+        # the template and includes next to it are found with any lookup
+        lookup.append(dirname(filename))
+        source, name = None, filename
     else:
         lookup = [abspath(x) for x in lookup if not isabs(x)
                   ]+[x for x in lookup if isabs(x)]
@@ -1779,20 +1863,15 @@ def dostpl(
             filename = abspath(outfile)
         except:
             filename = None
-        infile = _joinlines(infile)
+        source, name = _joinlines(infile), None
     variables = {}
     variables.update(globals())
     variables.update(kwargs)
     variables.update({'__file__': filename})
     if 'outinfo' not in variables and outfile:
         _, variables['outinfo'] = stem_ext(outfile)
-    stpl.TEMPLATES.clear()
-    st = stpl.template(
-        infile,
-        template_settings={'escape_func': lambda x: x},
-        template_lookup=lookup,
-        **variables
-    )
+    tpl = _stpl_template(source, name, tuple(lookup), _no_escape)
+    st = tpl.render(**variables)
     if outfile:
         with opnwrite(outfile) as f:
             f.write(st)
@@ -1945,7 +2024,7 @@ def dorst(
                 sysout = None  # create a file in these cases
             else:
                 try:
-                    sys.stdout = codecs.getwriter("utf-8")(sys.stdout.detach())
+                    sys.stdout.reconfigure(encoding='utf-8', newline='\n')
                 except: #noqa
                     pass
                 sysout = sys.stdout
@@ -1987,8 +2066,6 @@ def dorst(
         if sysout:
             sysout.write(_indented_default_role_math(filelines))
             links_done = False
-            _links_re = r'^\.\. include:: (.*)(_links_sphinx)(.re?st)'
-            rexincludelinks = re.compile(_links_re)
             for x in filelines:
                 #x = '.. include:: _links_sphinx.rest' #1
                 #x = '.. include:: ../_links_sphinx.rest' #2
@@ -2020,7 +2097,7 @@ def dorst(
                                 if tool == 'rst' and outinfo == 'html':
                                     sysout.write(_rst_id_fix(f.read()))
                                 else:
-                                    sysout.write(f.read())
+                                    shutil.copyfileobj(f, sysout)
                                 links_done = True
                 else:
                     sysout.write(x if x.endswith('\n') else x+'\n')
@@ -2160,7 +2237,7 @@ def convert(
         pass
     if not afile and (infile == '-' or infile is None):
         try:
-            sys.stdin = codecs.getreader("utf-8")(sys.stdin.detach())
+            sys.stdin.reconfigure(encoding='utf-8')
         except:
             pass
         infile = sys.stdin.readlines()
@@ -2262,10 +2339,10 @@ def rindices(regex, lns):
 
     '''
 
-    regex = re.compile(regex)
-    for i, ln in enumerate(lns):
-        if regex.search(ln):
-            yield i
+    if isinstance(regex, str):
+        regex = re.compile(regex)
+    # the loop over the lines runs in C
+    yield from compress(count(), map(regex.search, lns))
 
 
 def rlines(regex, lns):
@@ -2291,7 +2368,7 @@ def intervals(nms  # list of indices
         True
 
     """
-    return list(zip(nms[:], nms[1:]))
+    return list(pairwise(nms))
 
 
 def in2s(nms  # list of indices
@@ -2305,7 +2382,8 @@ def in2s(nms  # list of indices
         True
 
     """
-    return list(zip(nms[::2], nms[1::2]))
+    it = iter(nms)
+    return list(zip(it, it))
 
 
 # re.search(reid,'OpenDevices = None').groups()
@@ -2432,33 +2510,243 @@ def doc_parts(
         yield from (x[indent:] for x in lns[a + 1:b])
 
 
-# for generator function, instead of lru_cache()
-_Tee = tee([], 1)[0].__class__
+# .cache: path -> os.stat() result or None, during a _stat_session(),
+# per thread, as WAF scans in a thread
+_stat_local = local()
 
 
-def _memoized(f):
-    cache = {}
+def _cached_stat(fn):
+    # os.stat(fn) or None if there is no fn
+    cache = getattr(_stat_local, 'cache', None)
+    if cache is not None:
+        try:
+            return cache[fn]
+        except KeyError:
+            pass
+    try:
+        st = os.stat(fn)
+    except OSError:
+        st = None
+    if cache is not None:
+        cache[fn] = st
+    return st
 
-    def ret(*args):
-        if args not in cache:
-            cache[args] = f(*args)
-        if isinstance(cache[args], (GeneratorType, _Tee)):
-            cache[args], r = tee(cache[args])
-            return r
-        return cache[args]
 
-    return ret
+def _cached_exists(fn):
+    return _cached_stat(fn) is not None
 
 
-@lru_cache()
-def _read_lines(fn):
-    lns = []
+@contextlib.contextmanager
+def _stat_session():
+    # stats are cached while files and working directory stay unchanged,
+    # like during Fldrs.scandirs()
+    if getattr(_stat_local, 'cache', None) is not None:
+        yield  # within a session already
+        return
+    _stat_local.cache = {}
+    try:
+        yield
+    finally:
+        _stat_local.cache = None
+
+
+@lru_cache(maxsize=256)
+def _read_lines_cached(fn, mtime_ns):
     with opn(fn) as f:
-        lns = list(f.readlines())
-    return lns
+        return tuple(f.readlines())
+
+
+def _read_lines(fn):
+    """
+    Return the lines of ``fn`` as tuple.
+
+    Cached by absolute path and modification time,
+    i.e. a file changed during a build is read again.
+    """
+    st = _cached_stat(fn) or os.stat(fn)  # os.stat() raises if missing
+    return _read_lines_cached(os.path.abspath(fn), st.st_mtime_ns)
+
+
+_toctree, _directive, _tplinclude = range(3)
+
+
+# The result of _scan_include_lines() is also kept on disk across runs,
+# keyed by the file content, _rest and this module (version and modification time).
+# Entries older than a day are scanned again and removed.
+# The cache is in the user's cache folder, not shared with other users.
+def _user_cache_dir():
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'rstdoc')
+
+
+_include_cache_dir = _user_cache_dir()
+_include_cache_salt = '{} {}'.format(
+    __version__, os.stat(__file__).st_mtime_ns).encode()
+_include_cache_ttl = 24 * 60 * 60
+_include_cache_pruned = []
+
+
+def _include_cache_makedirs():
+    os.makedirs(_include_cache_dir, mode=0o700, exist_ok=True)
+
+
+def _include_cache_prune():
+    # once per process and cache folder: remove expired entries
+    if _include_cache_dir in _include_cache_pruned:
+        return
+    _include_cache_pruned.append(_include_cache_dir)
+    expired = time.time() - _include_cache_ttl
+    try:
+        with os.scandir(_include_cache_dir) as it:
+            # also the gen-*.json stamps of _gen_fldr(),
+            # which touches them when used
+            for e in it:
+                try:
+                    if e.stat().st_mtime < expired:
+                        os.remove(e.path)
+                except OSError:
+                    pass
+    except OSError:
+        pass
+
+
+def _include_cache_load(cachefile):
+    try:
+        if time.time() - os.stat(cachefile).st_mtime > _include_cache_ttl:
+            os.remove(cachefile)
+            return None
+        with open(cachefile, encoding='utf-8') as f:
+            return tuple((fl, kind, value if value is None else tuple(value))
+                         for fl, kind, value in json.load(f))
+    except:
+        return None
+
+
+def _include_cache_store(cachefile, res):
+    try:
+        _include_cache_makedirs()
+        tmpfile = '{}.{}'.format(cachefile, os.getpid())
+        with open(tmpfile, 'w', encoding='utf-8') as f:
+            json.dump(res, f)
+        os.replace(tmpfile, cachefile)
+    except:
+        pass
+    _include_cache_prune()
+
+
+# the only lines _scan_include_lines() can use:
+# toctree, directive, %include and indented .rest or .rst lines
+# (which of them are toctree entries depends on _rest)
+rexincludecandidate = re.compile(
+    rb'^(?:\.\. toctree::|[^\S\n]*\.\. |%| .*\.re?st[^\S\n]*$).*', re.M)
+
+
+def _include_candidates(buf, fn):
+    # lines of buf for _scan_include_lines(), decoding only these
+    if re.search(rb'\r(?!\n)', buf):  # old Mac line ends: read as text
+        return _read_lines(fn)
+    return [m.group().decode('utf-8').rstrip('\r') + '\n'
+            for m in rexincludecandidate.finditer(buf)]
+
+
+@lru_cache(maxsize=256)
+def _include_lines_cached(fn, mtime_ns, rest):
+    # rest: _rest, on which the toctree entries depend
+    with open(fn, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return ()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            key = blake2b(buf, digest_size=16)
+            key.update(_include_cache_salt)
+            key.update(rest.encode())
+            cachefile = os.path.join(
+                _include_cache_dir, key.hexdigest() + '.json')
+            res = _include_cache_load(cachefile)
+            if res is None:
+                res = _scan_include_lines(_include_candidates(buf, fn))
+                _include_cache_store(cachefile, res)
+    return res
+
+
+def _scan_include_lines(lns):
+    res = []
+    for aln in lns:
+        st = aln.strip()
+        # fl: None if not indented, else the toctree entry or ''
+        fl = None
+        if aln.startswith(' '):
+            fl = st if st.endswith(_rest) else ''
+        kind = value = None
+        if aln.startswith('.. toctree::'):
+            kind = _toctree
+        elif st.startswith('.. '):
+            # aln = '  .. include:: some.rst'
+            # aln = '  .. include:: ../some.rst'
+            # aln = '.. include:: some.rst'
+            # aln = '.. include:: ../some.rst'
+            # aln = '  .. image:: some.png'
+            # aln = '.. image:: some.png'
+            # aln = '  .. figure:: some.png'
+            # aln = '  .. |x y| image:: some.png'
+            # value: (included file or None, image or None)
+            m = rexincimg.search(aln)
+            if m and m.lastgroup == 'inc':
+                nf = m.group('inc')
+                # aln = '.. include:: a.rst figure:: a.png' #a.png if no a.rst
+                m = ':: ' in nf and reximg.search(nf)
+                kind, value = _directive, (nf, m and m.group(1))
+            elif m:
+                kind, value = _directive, (None, m.group('img'))
+        elif aln.startswith('%') and restplinclude.match(aln):
+            # aln="%include('some.rst.tpl', v='param')"
+            # aln="   %include('some.rst.tpl', v='param')"
+            kind, value = _tplinclude, tuple(restplinclude.split(aln))
+        if kind is not None or fl:
+            res.append((fl, kind, value))
+    return tuple(res)
+
+
+def _include_lines(fn):
+    """
+    Return the lines of ``fn`` relevant for |dcx.rstincluded|,
+    as tuple of (toctree entry, kind, value).
+
+    The lines are parsed once per file and modification time,
+    independent of the paths and flags of rstincluded(),
+    which e.g. differ between links and docs in WAF.
+    Between runs the parsed lines are cached on disk by file content.
+    """
+    st = _cached_stat(fn) or os.stat(fn)
+    return _include_lines_cached(os.path.abspath(fn), st.st_mtime_ns, _rest)
+
+
+@lru_cache(maxsize=4096)
+def _resolve_cached(fn, paths, cwd):
+    p = ''
+    for p in paths:
+        nfn = normjoin(p, fn)
+        if _cached_exists(nfn + _stpl):  # first, because original
+            return p, nfn + _stpl, fn + _stpl
+        elif _cached_exists(nfn):  # while this might be generated
+            return p, nfn, fn
+    return p, fn, fn
+
+
+def _resolve(fn, paths):
+    """
+    Return (path, path to file, file name) for |dcx.rstincluded|.
+
+    The ``.stpl`` is preferred.
+    The cache is per working directory, as ``paths`` can be relative.
+    """
+    return _resolve_cached(fn, paths, os.getcwd())
 
 
-@_memoized
 def rstincluded(
         fn,
         paths=(),
@@ -2466,7 +2754,7 @@ def rstincluded(
         withrest=False
         ):
     '''
-    Yield the files recursively included from an RST file.
+    Yield the files recursively included from an RST file, each once.
 
     :param fn: file name without path
     :param paths: paths where to look for fn
@@ -2481,8 +2769,8 @@ def rstincluded(
         ['ra.rest.stpl', '_links_sphinx.rst']
         >>> list(rstincluded('sr.rest',('../doc',)))
         ['sr.rest', '_links_sphinx.rst']
-        >>> list(rstincluded('meta.rest',('../doc',)))
-        ['meta.rest', 'files.rst', '_traceability_file.rst', '_links_...']
+        >>> list(rstincluded('readme.rest',('../doc',)))
+        ['readme.rest', 'files.rst', '_traceability_file.rst', '_links_sphinx.rst']
         >>> 'dd.rest' in list(rstincluded(
         ... 'index.rest',('../doc',), False, True))
         True
@@ -2490,71 +2778,76 @@ def rstincluded(
 
     '''
 
-    p = ''
-    for p in paths:
-        nfn = normjoin(p, fn)
-        if exists(nfn + _stpl):  # first, because original
-            nfn = nfn + _stpl
-            yield fn + _stpl
-            break
-        elif exists(nfn):  # while this might be generated
-            yield fn
-            break
-    else:
-        nfn = fn
-        yield fn
-    lns = _read_lines(nfn)
-    toctree = False
-    if lns:
-        for aln in lns:
-            if toctree:
-                toctreedone = False
-                if aln.startswith(' '):
-                    fl = aln.strip()
-                    if fl.endswith(_rest) and exists(normjoin(p, fl)):
-                        toctreedone = True
-                        yield from rstincluded(fl, paths)
-                    continue
-                elif toctreedone:
-                    toctree = False
-            if aln.startswith('.. toctree::'):
+    # relative paths and the toctree entries depend on cwd and _rest
+    res, err = _rstincluded(
+        fn, tuple(paths), withimg, withrest, os.getcwd(), _rest)
+    yield from res
+    if err:
+        raise err
+
+
+_rstincluded_active = set()
+
+
+@lru_cache(maxsize=1024)
+def _rstincluded(fn, paths, withimg, withrest, cwd, rest):
+    # (files, exception or None) for rstincluded():
+    # an exception ends the files like it would end a generator
+    key = (fn, paths, withimg, withrest, cwd, rest)
+    if key in _rstincluded_active:
+        return (), RstDocError('Cyclic include of ' + fn)
+    _rstincluded_active.add(key)
+    res = []
+    # a file included more than once is listed once
+    done = lambda err: (tuple(dict.fromkeys(res)), err)
+    try:
+        p, nfn, fnfound = _resolve(fn, paths)
+        res.append(fnfound)
+        toctree = False
+        for fl, kind, value in _include_lines(nfn):
+            if toctree and fl is not None:
+                if fl and _cached_exists(normjoin(p, fl)):
+                    sub, err = _rstincluded(fl, paths, False, False, cwd, rest)
+                    res.extend(sub)
+                    if err:
+                        return done(err)
+                continue
+            if kind == _toctree:
                 if withrest:
                     toctree = True
-            elif aln.strip().startswith('.. '):
-                # aln = '  .. include:: some.rst'
-                # aln = '  .. include:: ../some.rst'
-                # aln = '.. include:: some.rst'
-                # aln = '.. include:: ../some.rst'
-                # aln = '  .. image:: some.png'
-                # aln = '.. image:: some.png'
-                # aln = '  .. figure:: some.png'
-                # aln = '  .. |x y| image:: some.png'
-                try:
-                    f, t, _ = rerstinclude.split(aln)
-                    nf = not f.strip() and t
-                    if nf:
-                        if is_rest(nf) and not withrest:
-                            continue
-                        yield from rstincluded(nf.strip(), paths)
-                except:
-                    if withimg:
-                        m = reximg.search(aln)
-                        if m:
-                            yield m.group(1)
-            elif restplinclude.match(aln):
-                # aln="%include('some.rst.tpl', v='param')"
-                # aln="   %include('some.rst.tpl', v='param')"
-                f, t, _ = restplinclude.split(aln)
+            elif kind == _directive:
+                nf, img = value
+                if nf:
+                    if is_rest(nf) and not withrest:
+                        continue
+                    sub, err = _rstincluded(
+                        nf.strip(), paths, False, False, cwd, rest)
+                    res.extend(sub)
+                    if err and withimg and img:
+                        res.append(img)
+                elif withimg and img:
+                    res.append(img)
+            elif kind == _tplinclude:
+                f, t, _ = value
                 nf = not f.strip() and t
                 if nf:
                     thisnf = normjoin(p, nf)
-                    if not exists(thisnf):
+                    if not _cached_exists(thisnf):
                         parntnf = normjoin(p, '..', nf)
-                        if exists(parntnf):
+                        if _cached_exists(parntnf):
                             nf = parntnf
                         else:
                             continue
-                    yield from rstincluded(nf.strip(), paths)
+                    sub, err = _rstincluded(
+                        nf.strip(), paths, False, False, cwd, rest)
+                    res.extend(sub)
+                    if err:
+                        return done(err)
+        return done(None)
+    except Exception as err:
+        return done(err)
+    finally:
+        _rstincluded_active.discard(key)
 
 
 _traceability_instance = None
@@ -2629,18 +2922,18 @@ class Traceability:
                 [fnm + " " + clr for fnm, (_, clr) in target_id_color.items()])
             tlines.extend([': ' + legend, '\n'])
         tlines.append('\n')
-        with opnwrite(normjoin(linkroot, _traceability_file + _rst)) as f:
-            f.write('.. raw:: html\n\n')
-            f.write('    <object data="' + _traceability_file + _svg +
-                    '" type="image/svg+xml"></object>\n')
-            if target_id_color is not None:
-                f.write(
-                    '''    <p><a href="%s">FCA</a>
+        trclines = ['.. raw:: html\n\n',
+                    '    <object data="' + _traceability_file + _svg +
+                    '" type="image/svg+xml"></object>\n']
+        if target_id_color is not None:
+            trclines.append(
+                '''    <p><a href="%s">FCA</a>
                   diagram of dependencies with clickable nodes: ''' % (
-                      "https://en.wikipedia.org/wiki/Formal_concept_analysis"
-                    )
-                    + legend + '</p>\n\n')
-            f.writelines(tlines)
+                  "https://en.wikipedia.org/wiki/Formal_concept_analysis"
+                )
+                + legend + '</p>\n\n')
+        _write_if_changed(normjoin(linkroot, _traceability_file + _rst),
+                          ''.join(trclines + tlines))
         ld = pyfca.LatticeDiagram(fca, 4 * 297, 4 * 210)
 
         tracesvg = abspath(normjoin(linkroot, _traceability_file + _svg))
@@ -2704,6 +2997,12 @@ def pair(alist, blist, cmp):
             return
 
 
+@lru_cache(maxsize=256)
+def _compiled(code, filename, mode):
+    # gen() is called once per generated file with the same snippets
+    return compile(code, filename, mode)
+
+
 def gen(
         source,
         target=None,
@@ -2737,7 +3036,7 @@ def gen(
     if isinstance(source, str):
         lns = []
         try:
-            lns = _read_lines(source)
+            lns = list(_read_lines(source))
         except:
             sys.stderr.write("ERROR: {} cannot be opened\n".format(source))
             return
@@ -2752,9 +3051,7 @@ def gen(
         # re.compile(gen_regex).search('#def gen_sdf(lns,**kw):') #begin
         # re.compile(gen_regex).search('#def gen_sdf') #end
     else:
-        gen_regex = r'#\s*def gen(\w*(lns,\*\*kw):)*'
-        # re.compile(gen_regex).search('# def gen(lns,**kw):') #begin
-        # re.compile(gen_regex).search('# def gen') #end
+        gen_regex = rexgen
     iblks = list(rindices(gen_regex, lns))
     py3 = [
         lns[k][lns[i].index('#') + 1:] for i, j in in2s(iblks)
@@ -2762,20 +3059,19 @@ def gen(
     ]
     indent = py3[0].index(py3[0].lstrip())
     py3 = '\n'.join(x[indent:] for x in py3)
-    eval(compile(py3, source + r'#\s*gen', 'exec'), globals())
+    eval(_compiled(py3, source + r'#\s*gen', 'exec'), globals())
     if fun:
-        gened = list(eval('gen_' + fun + '(lns,**kw)'))
+        gened = list(globals()['gen_' + fun](lns, **kw))
     else:  # else eval all gen_ funtions
         gened = []
         for i in iblks[0::2]:
-            gencode = re.split(r"#\s*def |:", lns[i])[1]  # gen(lns,**kw)
-            gened += list(eval(gencode))
+            gencode = rexgensplit.split(lns[i])[1]  # gen(lns,**kw)
+            gened += list(eval(_compiled(gencode, source, 'eval')))
     if target:
         drn = dirname(target)
         if drn and not exists(drn):
             mkdir(drn)
-        with opnwrite(target) as o:
-            o.write(''.join(((x or '\n') for x in gened)))
+        _write_if_changed(target, ''.join(((x or '\n') for x in gened)))
     else:
         return gened
 
@@ -2832,11 +3128,11 @@ def _flatten_stpl_includes_it(fn):
     """
     flns = []
     if isinstance(fn, str):
-        if exists(fn):
+        if _cached_exists(fn):
             flns = _read_lines(fn)
         else:
             parnt = updir(fn)
-            if exists(parnt):
+            if _cached_exists(parnt):
                 flns = _read_lines(parnt)
     else:
         flns = fn
@@ -2873,14 +3169,15 @@ class Tgt:
 
     def is_inside_literal(self, lns):
         try:  # skip literal blocks
-            indentation = re.search(r'\w', lns[self.lnidx]).span()[0] - 3
+            indentation = rexwordchar.search(lns[self.lnidx]).span()[0] - 3
             if indentation > 0:
                 for iprev in range(self.lnidx - 1, 0, -1):
                     prev = lns[iprev]
                     if prev:
-                        newspc, _ = next((ich, ch)
-                                         for ich, ch in enumerate(prev)
-                                         if ch != ' ' and ch != '\t')
+                        nonblank = prev.lstrip(' \t')
+                        if not nonblank:  # ended the search before, too
+                            return
+                        newspc = len(prev) - len(nonblank)
                         if newspc < indentation:
                             prev = prev.strip()
                             if prev:
@@ -2920,20 +3217,20 @@ class Tgt:
             if j > lenlns - 1:
                 break
             lnj = lns[j]
-            if rextitle.match(lnj):
+            if lnj[:1] in _title_punct and rextitle.match(lnj):
                 lnkname = lns[j - 1].strip()
                 if not lnkname:
                     lnkname = lns[j + 1].strip()
                 break
+            # the str tests avoid regex calls for lines that cannot match
             # j, lns=1,".. figure::\n  :name: linkname".splitlines();lnj=lns[j]
             # j, lns=1,".. figure::\n  :name:".splitlines();lnj=lns[j]
             # j, lns=1,".. math::\n  :name: linkname".splitlines();lnj=lns[j]
-            itm = rexname.match(lnj)
+            itm = ':name:' in lnj and rexname.match(lnj)
             if itm:
                 lnkname, = itm.groups()
-                lnj1 = lns[j - 1].split('::')[0].replace(
-                    'list-table', 'table').replace('code-block',
-                                                   'code').strip()
+                lnj1 = lns[j - 1].split('::', 1)[0].strip()
+                lnj1 = _counted_directive_alias.get(lnj1, lnj1)
                 if counters and not lnkname and lnj1 in counters:
                     lnkname = name_from_directive(
                         lnj1.strip('. '), counters[lnj1])
@@ -2942,7 +3239,7 @@ class Tgt:
                 elif lnkname:
                     lnkname = lnkname.strip()
                     break
-            itm = rexitem.match(lnj)
+            itm = ':' in lnj and rexitem.match(lnj)
             if itm:
                 lnkname, = itm.groups()
                 break
@@ -2978,28 +3275,125 @@ class Tgt:
         id = self.target
         if linktype == 'latex':
             linktype = 'pdf'
+        # join is faster than format for these many small strings
         if tool == 'sphinx':
-            tgte = ".. |{0}| replace:: :ref:`{1}<{2}>`\n".format(
-                self.target, self.lnkname, id)
+            tgte = "".join((".. |", self.target, "| replace:: :ref:`",
+                            self.lnkname, "<", id, ">`\n"))
         else:
             if linktype == 'odt':
                 # https://github.com/jgm/pandoc/issues/3524
-                tgte = ".. |{0}| replace:: `{1} <file:../{2}#{3}>`__\n".format(
-                    self.target, self.lnkname, targetfile, id)
+                tgte = "".join((".. |", self.target, "| replace:: `",
+                                self.lnkname, " <file:../", targetfile,
+                                "#", id, ">`__\n"))
             else:
                 # https://sourceforge.net/p/docutils/bugs/378/
-                tgte = ".. |{0}| replace:: `{1} <file:{2}#{3}>`__\n".format(
-                    self.target, self.lnkname, targetfile, id)
+                tgte = "".join((".. |", self.target, "| replace:: `",
+                                self.lnkname, " <file:", targetfile,
+                                "#", id, ">`__\n"))
         if tool == 'rst' and linktype == 'html':
             return _rst_id_fix(tgte)
         else:
             return tgte
 
+    def create_links(self,
+                     linktypes,
+                     reststem
+                     ):
+        """Tgt.
+
+        Creates the links for all ``linktypes`` as ``create_link()`` does,
+        with tool sphinx for linktype sphinx and pandoc for the others,
+        joining the parts they share only once.
+
+        :param linktypes: the link types, e.g. ``g_links_types``
+        :param reststem:  the file name without extension
+
+        """
+        head = "".join((".. |", self.target, "| replace:: `", self.lnkname))
+        tail = "".join(("#", self.target, ">`__\n"))
+        links = []
+        for linktype in linktypes:
+            if linktype == 'sphinx':
+                links.append("".join((".. |", self.target, "| replace:: :ref:`",
+                                      self.lnkname, "<", self.target, ">`\n")))
+            else:
+                targetfile = reststem and reststem + '.' + linktype
+                # odt: https://github.com/jgm/pandoc/issues/3524
+                links.append("".join((
+                    head, " <file:../" if linktype == 'odt' else " <file:",
+                    targetfile, tail)))
+        return links
+
     def create_tag(self):
         return r'{0}	{1}	/\.\. _`\?{0}`\?:/;"		line:{2}'.format(
             self.target, self.tagentry[0], self.tagentry[1])
 
 
+# RstFile.make_tgts() results of the last documents,
+# keyed by a digest of the lines, not to keep the documents alive
+_make_tgts_cache = {}
+_make_tgts_cache_max = 256
+_make_tgts_lock = RLock()
+
+
+def _make_tgts_cached(lns, doc, counters, fn_i_ln):
+    # RstFile.make_tgts() for hashable arguments:
+    # returns the target fields and the counters afterwards
+    key = (blake2b(repr((lns, fn_i_ln)).encode('utf-8', 'surrogatepass'),
+                   digest_size=16).digest(), doc, counters)
+    with _make_tgts_lock:
+        res = _make_tgts_cache.pop(key, None)
+        if res is not None:
+            _make_tgts_cache[key] = res  # now the most recent
+            return res
+    res = _make_tgts_scan(lns, doc, counters, fn_i_ln)
+    with _make_tgts_lock:
+        _make_tgts_cache[key] = res
+        while len(_make_tgts_cache) > _make_tgts_cache_max:
+            del _make_tgts_cache[next(iter(_make_tgts_cache))]
+    return res
+
+
+def _make_tgts_scan(lns, doc, counters, fn_i_ln):
+    counters = dict(counters)
+    tgts = []
+    tgtnames = _tgt_names(lns)
+    itgts = list(tgtnames)
+    if fn_i_ln:
+        lns1 = [x[2] for x in fn_i_ln]
+        tgtnames1 = _tgt_names(lns1)
+        itgts1 = list(tgtnames1)
+    else:
+        lns1 = lns
+        tgtnames1 = tgtnames
+        itgts1 = itgts
+    if len(itgts) < len(itgts1):
+        paired_itgts_itgts1 = pair(itgts, itgts1,
+                                   lambda x, y: lns[x] == lns1[y])
+    elif len(itgts) > len(itgts1):
+        paired_itgts_itgts1 = ((i, j) for (
+            j, i) in pair(itgts1, itgts, lambda x, y: lns1[x] == lns[y]))
+    else:
+        paired_itgts_itgts1 = zip(itgts, itgts1)
+    for i, i1 in paired_itgts_itgts1:
+        ii, iis, names = (i, lns, tgtnames) if i else (i1, lns1, tgtnames1)
+        tgt = Tgt(ii, names[ii])
+        if tgt.is_inside_literal(iis):
+            continue
+        tgt.find_lnkname(iis, counters)
+        tgt.lnkidx = i
+        if i1:
+            if fn_i_ln:
+                tgt.tagentry = fn_i_ln[i1][:2]
+            else:
+                tgt.tagentry = (doc, ii)
+        else:
+            tgt.tagentry = (doc.replace(_stpl, ''), ii)
+        tgts.append(tgt)
+    return tuple((t.lnidx, t.target, t.lnkname, t.lnkidx, t.tagentry)
+                 for t in tgts), tuple(counters.items())
+
+
 class RstFile:
     def __init__(self, reststem, doc, tgts, lnks, nlns):
         '''RstFile.
@@ -3010,7 +3404,8 @@ class RstFile:
         :param doc: doc belonging to reststem,
             either included or itself (.rest, .rst, .stpl)
         :param tgts: list of Tgt objects yielded by |dcx.RstFile.make_tgts|.
-        :param lnks: list of (line index, target name (``|target|``)) tuples
+        :param lnks: list of (line index, target name (``|target|``)) tuples,
+            kept as the parallel lists ``lnkidxs`` and ``lnknames``
         :param nlns: number of lines of the doc
 
         '''
@@ -3018,24 +3413,24 @@ class RstFile:
         self.reststem = reststem
         self.doc = doc
         self.tgts = tgts
-        self.lnks = lnks
+        self.lnkidxs = [i for i, _ in lnks]
+        self.lnknames = [n for _, n in lnks]
         self.nlns = nlns
 
     def __str__(self):
         return str((self.doc, self.reststem))
 
     def add_links_and_tags(self, add_tgt, add_linksto):
-        iterlnks = iter(self.lnks)
         prevtgt = None
-        # unknowntgts = []
-        tgt = None
+        # links up to a target belong to the previous target
+        lo = 0
         for tgt in self.tgts:
             if tgt.lnidx is not None:
-                add_linksto(prevtgt, tgt.lnidx, iterlnks)  # , unknowntgts)
+                hi = bisect_right(self.lnkidxs, tgt.lnidx, lo)
+                add_linksto(prevtgt, self.lnknames[lo:hi])
+                lo = hi
                 add_tgt(tgt, self.reststem)
                 prevtgt = tgt
-        if tgt:
-            add_linksto(prevtgt, tgt.lnidx, iterlnks)  # , unknowntgts)
 
     @staticmethod
     def make_lnks(lns  # lines of the document
@@ -3046,10 +3441,11 @@ class RstFile:
 
         """
 
+        findall = rexlnks.findall
         for i, ln in enumerate(lns):
-            mo = rexlnks.findall(ln)
-            for g in mo:
-                yield i, g
+            if '|' in ln:
+                for g in findall(ln):
+                    yield i, g
 
     @staticmethod
     def make_tgts(
@@ -3063,6 +3459,7 @@ class RstFile:
         Yields ``((line index, tag address), target, link name)``
         of ``lns`` of a restructureText file.
         For a .stpl file the linkname comes from the generated RST file.
+        The targets are cached by content, e.g. for several ``dorst()`` calls.
 
         :param lns: lines of the document
         :param doc: the rst/rest document for tags
@@ -3074,38 +3471,15 @@ class RstFile:
 
         if counters is None:
             counters = make_counters()
-        itgts = list(rindices(rextgt, lns))
-        if fn_i_ln:
-            lns1 = [x[2] for x in fn_i_ln]
-            itgts1 = list(rindices(rextgt, lns1))
-        else:
-            lns1 = lns
-            itgts1 = itgts
-        if len(itgts) < len(itgts1):
-            paired_itgts_itgts1 = pair(itgts, itgts1,
-                                       lambda x, y: lns[x] == lns1[y])
-        elif len(itgts) > len(itgts1):
-            paired_itgts_itgts1 = ((i, j) for (
-                j, i) in pair(itgts1, itgts, lambda x, y: lns1[x] == lns[y]))
-        else:
-            paired_itgts_itgts1 = zip(itgts, itgts1)
-        lenlns = len(lns)
-        lenlns1 = len(lns1)
-        for i, i1 in paired_itgts_itgts1:
-            ii, iis, _ = (i, lns, lenlns) if i else (i1, lns1, lenlns1)
-            cur = iis[ii]
-            tgt = Tgt(ii, rextgt.search(cur).group(1))
-            if tgt.is_inside_literal(iis):
-                continue
-            tgt.find_lnkname(iis, counters)
-            tgt.lnkidx = i
-            if i1:
-                if fn_i_ln:
-                    tgt.tagentry = fn_i_ln[i1][:2]
-                else:
-                    tgt.tagentry = (doc, ii)
-            else:
-                tgt.tagentry = (doc.replace(_stpl, ''), ii)
+        tgts, newcounters = _make_tgts_cached(
+            tuple(lns), doc, tuple(counters.items()),
+            fn_i_ln and tuple(tuple(x) for x in fn_i_ln))
+        counters.update(newcounters)
+        for lnidx, target, lnkname, lnkidx, tagentry in tgts:
+            tgt = Tgt(lnidx, target)
+            tgt.lnkname = lnkname
+            tgt.lnkidx = lnkidx
+            tgt.tagentry = tagentry
             yield tgt
 
     @staticmethod
@@ -3125,14 +3499,14 @@ class RstFile:
 
         """
 
-        for i, ln in enumerate(lns):
-            asub = rexsubtgt.search(ln)
+        for ln in lns:
+            asub = '.. |' in ln and rexsubtgt.search(ln)
             if asub:
                 yield asub.group(1)
 
 
 g_links_types = "sphinx latex html pdf docx odt".split()
-class Fldr(OrderedDict):
+class Fldr(dict):
     def __init__(
             self,
             folder,
@@ -3151,6 +3525,8 @@ class Fldr(OrderedDict):
         :self.alltgts: set of all targets in the directory
         :self.allsubsts: set of all substitutions in the directory
         :self.counters: the counters for each rest file
+        :self.tracestart: (tracehtmltarget, reststem)
+            of the rest file including the traceability file
 
         """
 
@@ -3160,7 +3536,8 @@ class Fldr(OrderedDict):
         self.allfiles = set()
         self.alltgts = set()
         self.allsubsts = set()
-        self.rest_counters = defaultdict(dict)
+        self.rest_counters = {}
+        self.tracestart = None
 
     def __str__(self):
         return str(list(sorted(self.keys())))
@@ -3202,7 +3579,7 @@ class Fldr(OrderedDict):
 
     def add_rest(self,
                  restfile,
-                 exclude_paths_substrings=['_links_', _traceability_file]):
+                 exclude_paths_substrings=('_links_', _traceability_file)):
         """Fldr.
 
         Scans a rest file for included files and constructs all the targets.
@@ -3214,8 +3591,7 @@ class Fldr(OrderedDict):
         for restinc in rstincluded(restfile, (self.folder, )):
             pth = normjoin(self.folder, restinc).replace("\\", "/")
             if _traceability_file + _rst in restinc:
-                if pyfca and _traceability_instance is None:
-                    Traceability(stem(restfile))
+                if pyfca and self.tracestart is None:
                     has_traceability = True
                     continue
             if any(x in pth for x in exclude_paths_substrings):
@@ -3225,21 +3601,24 @@ class Fldr(OrderedDict):
         assert pths, "No file for "+restfile+" due to excluded " + str(exclude_paths_substrings)
         reststem = pths[0]
         reststem = stem(stem(reststem))
-        if reststem not in self.rest_counters:
-            self.rest_counters[reststem] = make_counters()
-        counters = self.rest_counters[reststem]
+        counters = self.rest_counters.get(reststem)
+        if counters is None:
+            counters = self.rest_counters[reststem] = make_counters()
         if has_traceability:
-            _traceability_instance.counters = counters
+            # also a Fldr scanned elsewhere can start the Traceability
+            self.tracestart = (stem(restfile), reststem)
+            if _traceability_instance is None:
+                Traceability(stem(restfile)).counters = counters
 
-        self.allfiles |= set(pths)
+        self.allfiles.update(pths)
 
         for doc in pths:
             rstpath = doc.replace(_stpl, '')
-            if doc.endswith(_stpl) and exists(rstpath):
+            if doc.endswith(_stpl) and _cached_exists(rstpath):
                 lns = _read_lines(doc.replace(_stpl, ''))
                 fn_i_ln = _flatten_stpl_includes(doc)
                 tgts = list(RstFile.make_tgts(lns, doc, counters, fn_i_ln))
-            elif not doc.endswith(_tpl) and not doc.endswith(_txt) and exists(
+            elif not doc.endswith(_tpl) and not doc.endswith(_txt) and _cached_exists(
                     doc):
                 lns = _read_lines(doc)
                 tgts = list(RstFile.make_tgts(lns, doc, counters))
@@ -3249,14 +3628,17 @@ class Fldr(OrderedDict):
             relp = relpath(reststem,start=self.linkroot)
             rstfile = RstFile(relp, doc, tgts, lnks, len(lns))
             self[doc] = rstfile
-            self.alltgts |= set([t.target for t in rstfile.tgts])
-            self.allsubsts |= set(RstFile.substs(lns))
+            self.alltgts.update(t.target for t in rstfile.tgts)
+            self.allsubsts.update(RstFile.substs(lns))
 
-    def create_links_and_tags(self):
+    def create_links_and_tags(self, out=None):
         """Fldr.
 
         Appends to links_xxx.rst and .tags in linkroot for files in this folder.
 
+        :param out: if given, {file name: list of texts}
+            collecting the texts to append instead of writing them
+
         The target IDs are grouped using target_id_group().
         To every group a color is associated. See ``conf.py``.
         This is used to color an FCA lattice diagram
@@ -3272,11 +3654,9 @@ class Fldr(OrderedDict):
         linkfiles = [(linktype, []) for linktype in g_links_types]
 
         def add_tgt(tgt, reststem):
-            for linktype, linklines in linkfiles:
-                linklines.append(
-                    tgt.create_link(
-                        linktype, normjoin(lnkrelfolder,reststem),
-                        linktype if linktype == 'sphinx' else 'pandoc'))
+            for (_, linklines), link in zip(linkfiles, tgt.create_links(
+                    g_links_types, normjoin(lnkrelfolder,reststem))):
+                linklines.append(link)
             if isabs(tgt.tagentry[0]):
                 tgt.tagentry = (relpath(tgt.tagentry[0], start=self.scanroot),
                                 tgt.tagentry[1])
@@ -3288,32 +3668,15 @@ class Fldr(OrderedDict):
             for _, linklines in linkfiles:
                 linklines.append(comment)
 
-        def add_linksto(prevtgt, lnidx, iterlnks, ojlnk=[0, None]):
+        def add_linksto(prevtgt, lnknames):
             # all the links from the block following prevtgt up to this tgt
             linksto = []
-
-            def chkappend(x):
-                if not prevtgt or x != prevtgt.target:
-                    linksto.append(x)
-
-            if ojlnk[1] and ojlnk[0] < lnidx:  # first link in the new prevtgt
-                if ojlnk[1] in self.alltgts:
-                    chkappend(ojlnk[1])
-                elif ojlnk[1] not in self.allsubsts:
-                    linksto.append('-' + ojlnk[1])
-                    # unknowntgts.append(ojlnk[1])
-                ojlnk[1] = None
-            if ojlnk[1] is None:  # remaining links in prevtgt up to this tgt
-                for j, lnk in iterlnks:
-                    if j > lnidx:  # links up to to this target
-                        ojlnk[:] = j, lnk
-                        break
-                    else:
-                        if lnk in self.alltgts:
-                            chkappend(lnk)
-                        elif lnk not in self.allsubsts:
-                            linksto.append('-' + lnk)
-                            # unknowntgts.append(lnk)
+            for lnk in lnknames:
+                if lnk in self.alltgts:
+                    if not prevtgt or lnk != prevtgt.target:
+                        linksto.append(lnk)
+                elif lnk not in self.allsubsts:
+                    linksto.append('-' + lnk)
             if _traceability_instance:
                 if prevtgt and linksto:
                     _traceability_instance.appendobject(linksto+[prevtgt.target])
@@ -3322,7 +3685,7 @@ class Fldr(OrderedDict):
                 add_links_comments(linksto)
 
         for rstfile in self.values():
-            add_links_comments('\n.. .. {0}\n\n'.format(rstfile.doc))
+            add_links_comments('\n.. .. ' + rstfile.doc + '\n\n')
             rstfile.add_links_and_tags(add_tgt, add_linksto)
         if _traceability_instance and self.linkroot==self.folder:
             tlines = _traceability_instance.create_traceability_file(self.linkroot)
@@ -3331,43 +3694,172 @@ class Fldr(OrderedDict):
                 for tgt in RstFile.make_tgts(tlines, trcrst,
                                              _traceability_instance.counters):
                     add_tgt(tgt, _traceability_instance.tracehtmltarget)
-        for linktype, linklines in linkfiles:
-            with opnappend(normjoin(self.linkroot,
-                                   '_links_'+linktype+_rst)) as f:
-                f.write('\n'.join(linklines))
-        ctags_python = ""
-        try:
-            ctags_python = cmd(
-                [
-                    'ctags', '-R', '--sort=0', '--fields=+n',
-                    '--languages=python', '--python-kinds=-i', '-f', '-', '*'
-                ],
-                cwd=self.scanroot)
-        finally:
-            with opnappend(normjoin(self.scanroot, '.tags')) as f:
-                if ctags_python: f.write(ctags_python)
-                if tagentries: f.write('\n'.join(tagentries)+'\n')
+        if tagentries:
+            tagentries.append('')
+        texts = [(normjoin(self.linkroot, '_links_'+linktype+_rst),
+                  '\n'.join(linklines)) for linktype, linklines in linkfiles]
+        texts.append((normjoin(self.scanroot, '.tags'), '\n'.join(tagentries)))
+        for fn, text in texts:
+            if out is None:
+                with open(fn, 'ab') as f:
+                    f.write(text.encode('utf-8'))
+            else:
+                out.setdefault(fn, []).append(text)
+
+
+# Fldrs.scandirs() and index_dir() use processes
+# only from this number of folders on
+_parallel_scan_min = 8
+
+
+def _worker_init(a_rest, include):
+    # the module state the workers depend on
+    _set_rstrest(a_rest)
+    g_include[:] = include
+
+
+def _mp_context():
+    # not fork: WAF calls links_and_tags() from a thread
+    import multiprocessing
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def _process_pool(max_workers):
+    # the workers start without this module's state: it is passed along
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(
+        max_workers, mp_context=_mp_context(),
+        initializer=_worker_init, initargs=(_rest, list(g_include)))
+
+
+def _scan_fldr(folder, linkroot, scanroot, fs):
+    # Fldrs.scandirs() worker:
+    # returns the Fldr and the files and directories the scan depended on
+    fldr = Fldr(folder, linkroot, scanroot)
+    deps = set()
+    with _stat_session():  # a worker process has none yet
+        fldr.scanfiles(fs)
+        for doc in fldr.allfiles:
+            # a new .stpl would be included instead
+            deps.update((doc, doc.replace(_stpl, ''),
+                         doc.replace(_stpl, '') + _stpl))
+            if doc.endswith(_stpl) and doc in fldr:
+                deps.update(f for f, _, _ in _flatten_stpl_includes(doc))
+    return fldr, deps
+
+
+# Fldrs.scandirs() keeps the scanned Fldr's in this file in scanroot.
+# A Fldr is scanned again, if the rest files of its directory
+# or one of the files it depends on changed.
+_scan_cache_file = '.rstdcx-cache.json'
+
+
+def _scan_stamp(fn):
+    st = _cached_stat(fn)
+    return st and (st.st_mtime_ns, st.st_size)
+
+
+def _scan_stamps(deps):
+    return tuple((f, _scan_stamp(f)) for f in sorted(deps))
+
+
+def _fldr_to_json(fldr):
+    # a Fldr as plain lists and dicts
+    return {
+        'folder': fldr.folder,
+        'linkroot': fldr.linkroot,
+        'scanroot': fldr.scanroot,
+        'allfiles': sorted(fldr.allfiles),
+        'alltgts': sorted(fldr.alltgts),
+        'allsubsts': sorted(fldr.allsubsts),
+        'rest_counters': fldr.rest_counters,
+        'tracestart': fldr.tracestart,
+        'rstfiles': [[
+            r.reststem, r.doc, r.nlns, r.lnkidxs, r.lnknames,
+            [[t.lnidx, t.target, t.lnkname, t.lnkidx, t.tagentry]
+             for t in r.tgts]] for r in fldr.values()]
+    }
+
+
+def _fldr_from_json(js):
+    fldr = Fldr(js['folder'], js['linkroot'], js['scanroot'])
+    fldr.allfiles = set(js['allfiles'])
+    fldr.alltgts = set(js['alltgts'])
+    fldr.allsubsts = set(js['allsubsts'])
+    fldr.rest_counters = js['rest_counters']
+    fldr.tracestart = js['tracestart'] and tuple(js['tracestart'])
+    for reststem, doc, nlns, lnkidxs, lnknames, tgts in js['rstfiles']:
+        rstfile = RstFile(reststem, doc, [], list(zip(lnkidxs, lnknames)), nlns)
+        for lnidx, target, lnkname, lnkidx, tagentry in tgts:
+            tgt = Tgt(lnidx, target)
+            tgt.lnkname = lnkname
+            tgt.lnkidx = lnkidx
+            tgt.tagentry = tagentry and tuple(tagentry)
+            rstfile.tgts.append(tgt)
+        fldr[doc] = rstfile
+    return fldr
+
+
+def _scan_cache_load(cachefile, header):
+    # {(folder, linkroot, files): (Fldr, stamps)}
+    try:
+        with open(cachefile, encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache['header'] != header:
+            return {}
+        return {(folder, linkroot, tuple(fs)): (
+            _fldr_from_json(js),
+            tuple((f, stamp and tuple(stamp)) for f, stamp in stamps))
+                for folder, linkroot, fs, stamps, js in cache['fldrs']}
+    except:
+        return {}
+
 
+def _scan_cache_store(cachefile, header, cache):
+    try:
+        fldrs = [[folder, linkroot, fs, stamps, _fldr_to_json(fldr)]
+                 for (folder, linkroot, fs), (fldr, stamps) in cache.items()]
+        tmpfile = '{}.{}'.format(cachefile, os.getpid())
+        with open(tmpfile, 'w', encoding='utf-8') as f:
+            json.dump({'header': header, 'fldrs': fldrs}, f)
+        os.replace(tmpfile, cachefile)
+    except:
+        pass
 
-class Fldrs(OrderedDict):
+
+class Fldrs(dict):
     def __init__(
             self,
-            scanroot='.'
+            scanroot='.',
+            max_workers=None,
+            cache=True
             ):
         """
         Represents a directory hierarchy below ``scanroot``.
 
         :param scanroot: root path to start scanning
             for independent doc directories
+        :param max_workers: processes to scan the directories
+            (default: number of CPUs), 1 to scan in this process
+        :param cache: False to neither read nor write ``.rstdcx-cache.json``
 
         .tags: paths are relative to ``scanroot``.
 
         _links_xxx.rst: paths are relative to the first directory with a ``.rest``.
         Place e.g. index.rest in a folder above, to link between folders.
 
+        .rstdcx-cache.json: the scanned directories,
+        to scan only those with changed files next time.
+        The sample trees of ``--init`` list it in ``.gitignore``.
+
         """
 
         self.scanroot = scanroot
+        self.max_workers = max_workers
+        self.cache = cache
+        self.linkroots = []
 
     def __str__(self):
         return super().__str__()
@@ -3375,30 +3867,102 @@ class Fldrs(OrderedDict):
     def scandirs(self):
         #_images, and dot files excluded
         notexcluded = lambda d: not d.startswith('_') and not (len(d)>1 and d[0]=='.' and d[1]!='.')
+        # a folder with a .rest[.stpl] gets a Fldr entry
+        # so linkroots are known before scanning
+        todo = []
+        linkroots = self.linkroots = []
         linkroot = None
-        for p, ds, fs in os.walk(self.scanroot):
-            ds[:] = [d for d in ds if notexcluded(d)]
-            if notexcluded(base(p)):
+        for p, fs in _walk(self.scanroot, notexcluded):
+            if notexcluded(base(p)) and any(is_rest(f) for f in fs):
                 njp = normjoin(p)
-                fldr = Fldr(njp,linkroot or njp,self.scanroot)
-                fldr.scanfiles(fs)
+                todo.append((njp, linkroot or njp, self.scanroot, fs))
+                if not linkroot or not abspath(njp).startswith(abspath(linkroot)):
+                    linkroot = njp
+                    linkroots.append(linkroot)
+        cachefile = normjoin(self.scanroot, _scan_cache_file)
+        header = [_include_cache_salt.decode(), _rest, list(g_include),
+                  os.getcwd(), self.scanroot]
+        cached = _scan_cache_load(cachefile, header) if self.cache else {}
+        # scanfiles() uses only the rest files of fs
+        keys = [(folder, linkroot, tuple(f for f in fs if is_rest(f)))
+                for folder, linkroot, _, fs in todo]
+        # nothing is written while scanning: stats can be cached
+        with _stat_session():
+            # (Fldr, stamps of the files it depends on) per folder
+            scanned = [None] * len(todo)
+            for i, key in enumerate(keys):
+                fldr, stamps = cached.get(key, (None, None))
+                if stamps and all(_scan_stamp(f) == stamp
+                                  for f, stamp in stamps):
+                    scanned[i] = fldr, stamps
+            tbd = [i for i, x in enumerate(scanned) if x is None]
+            if len(tbd) >= _parallel_scan_min and self.max_workers != 1:
+                try:
+                    with _process_pool(self.max_workers) as executor:
+                        for i, (fldr, deps) in zip(tbd, executor.map(
+                                _scan_fldr, *zip(*[todo[i] for i in tbd]))):
+                            scanned[i] = fldr, _scan_stamps(deps)
+                except Exception:
+                    pass  # scan again here, to raise the actual error
+            for i, args in enumerate(todo):
+                if scanned[i] is None:
+                    fldr, deps = _scan_fldr(*args)
+                    scanned[i] = fldr, _scan_stamps(deps)
+                fldr = scanned[i][0]
+                trc = fldr.tracestart
+                if trc and _traceability_instance is None:
+                    Traceability(trc[0]).counters = fldr.rest_counters.get(trc[1])
                 if len(fldr):
-                    self[njp] = fldr
-                    if not linkroot or not abspath(njp).startswith(abspath(linkroot)):
-                        linkroot = njp
-                        for linktype in g_links_types:
-                            with opnwrite(normjoin(linkroot,
-                                   '_links_'+linktype+_rst)) as f:
-                                f.write('.. .. .. %s'%linkroot)
-                            rmrf(normjoin(self.scanroot, '.tags'))
+                    self[fldr.folder] = fldr
+        # stored before create_links_and_tags() changes the Fldr's
+        if self.cache and (tbd or len(cached) != len(todo)):
+            _scan_cache_store(cachefile, header, dict(zip(keys, scanned)))
+
+    def create_links_and_tags(self):
+        """Fldrs.
+
+        Calls ``Fldr.create_links_and_tags()`` for all folders.
+        Then the Python tags of ``scanroot`` are appended to ``.tags``,
+        running ``ctags`` once for the whole tree.
+
+        The texts are collected and every file is written once at the end,
+        and only if changed, to not trigger rebuilds of unchanged files.
+
+        """
+
+        if not self.linkroots:
+            return
+        out = {}
+        for linkroot in self.linkroots:
+            for linktype in g_links_types:
+                out[normjoin(linkroot, '_links_'+linktype+_rst)
+                    ] = ['.. .. .. %s'%linkroot]
+        tagsfile = normjoin(self.scanroot, '.tags')
+        out[tagsfile] = []
+        try:
+            #reversed to do create_traceability_file at the end
+            for fldr in reversed(self.values()):
+                fldr.create_links_and_tags(out)
+            if self:
+                out[tagsfile].append(cmd(
+                    [
+                        'ctags', '-R', '--sort=0', '--fields=+n',
+                        '--languages=python', '--python-kinds=-i', '-f', '-', '*'
+                    ],
+                    cwd=self.scanroot))
+        finally:
+            for fn, texts in out.items():
+                _write_if_changed(fn, ''.join(texts))
 
 def links_and_tags(
-    scanroot='.'
+    scanroot='.',
+    cache=True
     ):
     '''
     Creates ``_links_xxx.rst`` files and a ``.tags``.
 
     :param scanroot: directory for which to create links and tags
+    :param cache: False not to use ``.rstdcx-cache.json`` (see ``Fldrs``)
 
     ::
 
@@ -3408,18 +3972,16 @@ def links_and_tags(
         >>> '_links_sphinx.rst' in ls('../doc')
         False
 
-        >>> links_and_tags('../doc')
+        >>> links_and_tags('../doc', cache=False)
         >>> '_links_sphinx.rst' in ls('../doc')
         True
         >>> cd(olddir)
 
     '''
 
-    fldrs = Fldrs(scanroot)
+    fldrs = Fldrs(scanroot, cache=cache)
     fldrs.scandirs()
-    #reversed to do create_traceability_file at the end
-    for folder,fldr in reversed(fldrs.items()):
-        fldr.create_links_and_tags()
+    fldrs.create_links_and_tags()
 
 def _kw_from_path(kwpth,rexkwsplit=rexkwsplit):
     """use names of path up to project root as keywords
@@ -3466,6 +4028,43 @@ def _kw_from_line(ln,rexkwsplit=rexkwsplit):
     """
     return frozenset(x for x in re.split(rexkwsplit,ln.lower()) if x)
 
+def _walk(dir, enter=None):
+    '''
+    Yield (root, file names) for ``dir`` and below in ``os.walk()`` order.
+
+    The directory entries of ``os.scandir()`` tell dirs and files apart
+    without further stat calls. Like ``os.walk()``, symlinked dirs are not entered.
+
+    :param enter: if given, only subdirectories with ``enter(name)`` are entered
+
+    '''
+    try:
+        with os.scandir(dir) as it:
+            entries = list(it)
+    except OSError:
+        return
+    subdirs = []
+    files = []
+    for entry in entries:
+        try:
+            isdir = entry.is_dir()
+        except OSError:
+            isdir = False
+        if not isdir:
+            files.append(entry.name)
+        elif not entry.is_symlink() and (enter is None or enter(entry.name)):
+            subdirs.append(entry.path)
+    yield dir, files
+    for subdir in subdirs:
+        yield from _walk(subdir, enter)
+
+
+def _walk_files(dir):
+    # (root, name) of the files below dir
+    for root, files in _walk(dir):
+        for name in files:
+            yield root, name
+
 def grep(
       regexp=rexkw,
       dir=None,
@@ -3492,17 +4091,17 @@ def grep(
     if dir is None:
         dir = os.getcwd()
     regexp = re.compile(regexp)
-    for root, dirs, files in os.walk(dir):
-        for name in files:
-            if any(name.endswith(ext) for ext in exts):
-                f = normjoin(root,name)
-                if not f.endswith('.py') and not f.endswith(_stpl) and exists(f+_stpl):
-                    continue
-                with open(f,encoding="utf-8") as fb:
-                    lines=[l.strip() for l in fb.readlines()]
-                    res = [(i,lines[i]) for i in rindices(regexp, lines)]
-                    for (i,l) in res:
-                        yield (f,i+1,l)
+    exts = tuple(exts)
+    for root, name in _walk_files(dir):
+        if name.endswith(exts):
+            f = normjoin(root,name)
+            if not f.endswith('.py') and not f.endswith(_stpl) and exists(f+_stpl):
+                continue
+            with open(f,encoding="utf-8") as fb:
+                lines=[l.strip() for l in fb.readlines()]
+                res = [(i,lines[i]) for i in rindices(regexp, lines)]
+                for (i,l) in res:
+                    yield (f,i+1,l)
 
 def yield_with_kw (kws, fn_ln_kw=None, **kwargs):
     '''
@@ -4198,6 +4797,8 @@ except:
 # this is for mktree(): first line of file content must not be empty!
 example_rest_tree = r'''
        build/
+       .gitignore
+         .rstdcx-cache.json
        dcx.py << file:///__dcx__
        reference.tex << file:///__tex_ref__
        reference.docx << file:///__docx_ref__
@@ -5373,6 +5974,8 @@ example_stpl_subtree = r'''
 
 
 example_ipdt_tree = r'''
+       .gitignore
+         .rstdcx-cache.json
        wafw.py << file:///__wafw__
        waf
          #!/usr/bin/env sh
@@ -6051,6 +6654,8 @@ example_ipdt_tree = r'''
              %end #epilog'''
 
 example_over_tree = r'''
+  .gitignore
+    .rstdcx-cache.json
   wafw.py << file:///__wafw__
   waf
     #!/usr/bin/env sh
@@ -6359,6 +6964,12 @@ example_over_tree = r'''
      .. include:: /_links_sphinx.rst'''
 
 
+# the placeholders in the example trees, replaced in one pass
+rexinitplaceholder = re.compile(
+    r'__(?:dcx|tex_ref|docx_ref|odt_ref|wafw|code)__')
+rexrestrst = re.compile(r'\.re?st')
+
+
 def initroot(
         rootfldr
         ,sampletype
@@ -6379,9 +6990,8 @@ def initroot(
     def rR(instr):
         if _rest == '.rst':
             #>instr='x.rst y.rest z.rst'
-            instr = instr.replace('.rst','.rrrr')
-            instr = instr.replace('.rest','.rst')
-            instr = instr.replace('.rrrr','.rest')
+            instr = rexrestrst.sub(
+                lambda m: '.rst' if m.group() == '.rest' else '.rest', instr)
             #>instr == 'x.rest y.rst z.rest'
         return instr
 
@@ -6403,16 +7013,16 @@ def initroot(
     else:
         example_tree=example_rest_tree
     example_tree = rR(example_tree)
-    inittree = [
-        l for l in example_tree.replace(
-            '__dcx__', thisfile).replace(
-            '__tex_ref__', tex_ref).replace(
-            '__docx_ref__', docx_ref).replace(
-            '__odt_ref__', odt_ref).replace(
-            '__wafw__', wafw).replace(
-            '__code__', rootfldr.strip()=='.' and base(cwd()) or rootfldr
-            ).splitlines()
-    ]
+    placeholders = {
+        '__dcx__': thisfile,
+        '__tex_ref__': tex_ref,
+        '__docx_ref__': docx_ref,
+        '__odt_ref__': odt_ref,
+        '__wafw__': wafw,
+        '__code__': rootfldr.strip()=='.' and base(cwd()) or rootfldr
+    }
+    inittree = rexinitplaceholder.sub(
+        lambda m: placeholders[m.group()], example_tree).splitlines()
     if sampletype == 'stpl':
         def _replace_lines(origlns, start, stop, insertlns):
             return origlns[:list(rindices(start, origlns))
@@ -6424,13 +7034,86 @@ def initroot(
     with new_cwd(rootfldr):
         txdir.view_to_tree(inittree)
 
+def _file_digest(fn):
+    try:
+        with open(fn, 'rb') as f:
+            return blake2b(f.read(), digest_size=16).hexdigest()
+    except OSError:
+        return None
+
+
+# gen() does not rewrite an unchanged target, which then stays older
+# than a touched source. Not to generate it again every time,
+# _gen_fldr() keeps {target: [input digest, target digest]} per gen file.
+# Stamps not used for a day are removed with the include cache entries.
+def _gen_stampfile(genpth):
+    return os.path.join(_include_cache_dir, 'gen-{}.json'.format(
+        blake2b(abspath(genpth).encode(), digest_size=16).hexdigest()))
+
+
+def _gen_input_digest(source, genpth, fun, kw):
+    # what gen() makes the target from, including this module
+    digests = [_file_digest(source), _file_digest(genpth)]
+    if None in digests:
+        return None
+    return blake2b(repr((digests, fun, sorted(kw.items()))).encode()
+                   + _include_cache_salt, digest_size=16).hexdigest()
+
+
+def _gen_fldr(folder):
+    # index_dir() worker process: runs the gen file of folder
+    # and returns the error message or None
+    genpth = normjoin(folder, 'gen')
+    stampfile = _gen_stampfile(genpth)
+    try:
+        with open(stampfile, encoding='utf-8') as f:
+            stamps = json.load(f)
+    except:
+        stamps = {}
+    newstamps = {}
+    try:
+        for f, t, d, kw in parsegenfile(genpth):
+            source, target = normjoin(folder, f), normjoin(folder, t)
+            key = abspath(target)
+            # generate only if the source or the gen file changed
+            if filenewer(source, target) or filenewer(genpth, target):
+                digest = _gen_input_digest(source, genpth, d, kw)
+                stamp = [digest, _file_digest(target)]
+                if digest is None or stamps.get(key) != stamp:
+                    gen(source, target=target, fun=d, **kw)
+                    stamp = [digest, _file_digest(target)]
+                if digest is not None:
+                    newstamps[key] = stamp
+            elif key in stamps:
+                newstamps[key] = stamps[key]
+    except Exception as err:
+        return ('Generating files in %s seems not meant to be done: %s' %
+                (genpth, str(err)))
+    finally:
+        try:
+            if newstamps != stamps:
+                _include_cache_makedirs()
+                tmpfile = '{}.{}'.format(stampfile, os.getpid())
+                with open(tmpfile, 'w', encoding='utf-8') as f:
+                    json.dump(newstamps, f)
+                os.replace(tmpfile, stampfile)
+            elif stamps:
+                os.utime(stampfile)  # not to expire while in use
+        except:
+            pass
+        _include_cache_prune()
+
+
 def index_dir(
-    root='.'
+    root='.',
+    max_workers=None
     ):
     '''
     Index a directory.
 
     :param root: All subdirectories of ``root`` that contain a ``.rest`` or ``.rest.stpl`` file are indexed.
+    :param max_workers: processes to scan and generate per directory
+        (default: number of CPUs), 1 to do all in this process
 
     - expands the .stpl files
     - generates the files as defined in the ``gen`` file (see example in dcx.py)
@@ -6451,23 +7134,25 @@ def index_dir(
             except Exception as err:
                 print('Error expanding %s: %s' % (dpth, str(err)))
     # link, gen and tags per directory
-    fldrs = Fldrs(root)
+    fldrs = Fldrs(root, max_workers)
     fldrs.scandirs()
-    #reversed to do create_traceability_file at the end
-    for folder, fldr in reversed(fldrs.items()):
-        # generated files need to be there to be indexed
-        genpth = normjoin(folder, 'gen')
-        if exists(genpth):
-            try:
-                for f, t, d, kw in parsegenfile(genpth):
-                    gen(normjoin(folder, f),
-                        target=normjoin(folder, t),
-                        fun=d,
-                        **kw)
-            except Exception as err:
-                print('Generating files in %s seems not meant to be done: %s' %
-                      (genpth, str(err)))
-        fldr.create_links_and_tags()
+    # the gen files of different directories are independent
+    genfolders = [folder for folder in reversed(fldrs)
+                  if exists(normjoin(folder, 'gen'))]
+    errs = None
+    if len(genfolders) >= _parallel_scan_min and max_workers != 1:
+        try:
+            with _process_pool(max_workers) as executor:
+                errs = list(executor.map(_gen_fldr, genfolders))
+        except Exception:
+            errs = None  # generate again here
+    if errs is None:
+        errs = [_gen_fldr(folder) for folder in genfolders]
+    for err in errs:
+        if err:
+            print(err)
+    # links and tags append to shared files: one directory after the other
+    fldrs.create_links_and_tags()
 
 
 description = (
@@ -6479,6 +7164,7 @@ description = (
 ``rstdcx`` is the same as ``rstdoc``.
 
 Without parameters: creates ``|substitution|`` links and .tags ctags for reST targets.
+The scanned directories are cached in ``.rstdcx-cache.json``.
 
 With two or three parameters: process file or dir to out file or dir
 through Pandoc, Sphinx, Docutils (third parameter):
@@ -176,7 +176,7 @@ def reflowparagraphs(lns, sentence=False):
                 if not dstrip:
                     yield from reflowp(p)
                     yield d
-                elif any([rp.match(dstrip) for rp in _pgrphrex]):
+                elif any(rp.match(dstrip) for rp in _pgrphrex):
                     yield from reflowp(p)
                     p.append(d)
                 else:
@@ -226,17 +226,21 @@ def no3star(lns):
 
     '''
 
+    s4 = re.compile('\*\*\*\*+')
+    sb = re.compile('(\w)\s+\*\*\s*$')
+    s2 = re.compile('^\s*\*\*\s*(\*\*)*$')
+    sc = re.compile('^:$')
     for d in lns:
         # d='****'
-        res = re.sub('\*\*\*\*+', '', d)
+        res = s4.sub('', d)
         # res='***Hello***'
         res = res.replace('***', '**')
         #res='**space before **'
-        res = re.sub('(\w)\s+\*\*\s*$', r'\1**', res)
+        res = sb.sub(r'\1**', res)
         # res='**'
-        res = re.sub('^\s*\*\*\s*(\*\*)*$', r'', res)
+        res = s2.sub(r'', res)
         res = res.replace('.. _``:', '')
-        res = re.sub('^:$', r'', res)
+        res = sc.sub(r'', res)
         yield res
 
 
@@ -303,10 +307,15 @@ def main(**args):
 
     '''
 
-    import codecs
     import sys
     import argparse
 
+    # "-" is sys.stdin, to be read as utf-8 like the files
+    try:
+        sys.stdin.reconfigure(encoding='utf-8')
+    except: #noqa
+        pass
+
     if not args:
         parser = argparse.ArgumentParser(
             description=
@@ -358,9 +367,8 @@ def main(**args):
         if args['in_place']:
             f = open(infile.name, 'w', encoding='utf-8', newline='\n')
         else:
-            # '≥'.encode('cp1252') # UnicodeEncodeError on Windows, therefore...  makes problems with pdb, though
-            sys.stdout = codecs.getwriter("utf-8")(sys.stdout.detach())
-            sys.stdin = codecs.getreader("utf-8")(sys.stdin.detach())
+            # '≥'.encode('cp1252') # UnicodeEncodeError on Windows, therefore
+            sys.stdout.reconfigure(encoding='utf-8', newline='\n')
             f = sys.stdout
         try:
             f.writelines(reflow(lns, args['join'], sentence=args['sentence']))
@@ -137,10 +137,15 @@ def main(**args):
 
     '''
 
-    import codecs
     import sys
     import argparse
 
+    # "-" is sys.stdin, to be read as utf-8 like the files
+    try:
+        sys.stdin.reconfigure(encoding='utf-8')
+    except: #noqa
+        pass
+
     def prefix(fn):
         m = re.match(r'[\s\d\W]*([^\s\W]*).*',
                      os.path.splitext(os.path.split(fn)[1])[0])
@@ -177,9 +182,8 @@ def main(**args):
         if args['in_place']:
             f = open(infile.name, 'w', encoding='utf-8', newline='\n')
         else:
-            # '≥'.encode('cp1252') # UnicodeEncodeError on Windows, therefore...  makes problems with pdb, though
-            sys.stdout = codecs.getwriter("utf-8")(sys.stdout.detach())
-            sys.stdin = codecs.getreader("utf-8")(sys.stdin.detach())
+            # '≥'.encode('cp1252') # UnicodeEncodeError on Windows, therefore
+            sys.stdout.reconfigure(encoding='utf-8', newline='\n')
             f = sys.stdout
         np = os.path.dirname(infile.name)
         try:
@@ -235,10 +235,15 @@ def main(**args):
 
     '''
 
-    import codecs
     import sys
     import argparse
 
+    # "-" is sys.stdin, to be read as utf-8 like the files
+    try:
+        sys.stdin.reconfigure(encoding='utf-8')
+    except: #noqa
+        pass
+
     if not args:
         parser = argparse.ArgumentParser(
             description=
@@ -271,9 +276,8 @@ def main(**args):
         if args['in_place']:
             f = open(infile.name, 'w', encoding='utf-8', newline='\n')
         else:
-            # '≥'.encode('cp1252') # UnicodeEncodeError on Windows, therefore...  makes problems with pdb, though
-            sys.stdout = codecs.getwriter("utf-8")(sys.stdout.detach())
-            sys.stdin = codecs.getreader("utf-8")(sys.stdin.detach())
+            # '≥'.encode('cp1252') # UnicodeEncodeError on Windows, therefore
+            sys.stdout.reconfigure(encoding='utf-8', newline='\n')
             f = sys.stdout
         try:
             f.writelines(
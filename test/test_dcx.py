@@ -42,12 +42,37 @@ rstdcx, dcx.py
 
 '''
 
+import shlex
+import shutil
 import subprocess
 def run(x,**kwargs):
-    if 'win' in sys.platform:
-        return subprocess.run(x,shell=True,**kwargs)
+    # no shell: a string is split into arguments and ``|`` pipes the commands
+    if isinstance(x,str):
+        lex = shlex.shlex(x,posix=os.name!='nt',punctuation_chars='|')
+        lex.whitespace_split = True
+        cmds = [[]]
+        for t in lex:
+            if t == '|':
+                cmds.append([])
+            else:
+                cmds[-1].append(t)
     else:
-        return subprocess.run(x,shell=False,**kwargs)
+        cmds = [list(x)]
+    cmds = [[shutil.which(c[0]) or c[0]]+c[1:] for c in cmds]
+    stdin = kwargs.pop('stdin',None)
+    procs = []
+    for c in cmds[:-1]:
+        p = subprocess.Popen(c,stdin=stdin,stdout=subprocess.PIPE)
+        if procs:
+            procs[-1].stdout.close()
+        procs.append(p)
+        stdin = p.stdout
+    try:
+        return subprocess.run(cmds[-1],stdin=stdin,**kwargs)
+    finally:
+        for p in procs:
+            p.stdout.close()
+            p.wait()
 
 _lnkname=[
 ("""
@@ -124,6 +149,58 @@ def test_lnkname(lnsres):
         ))
     assert next((x.target,x.lnkname) for x in tgts)==res
 
+def test_links_to_previous_target():
+    '''
+    Links up to a target belong to the previous target of the same file.
+    '''
+    lns = """
+.. _`a1`:
+
+|b1| before a2
+
+.. _`a2`:
+
+|b1| |a1| after a2
+""".splitlines()
+    linksto = []
+    def add_linksto(prevtgt, lnknames):
+        linksto.append((prevtgt and prevtgt.target, list(lnknames)))
+    for _ in range(2):
+        tgts = list(RstFile.make_tgts(lns,'a.rest'))
+        rstfile = RstFile('a','a.rest',tgts,list(RstFile.make_lnks(lns)),len(lns))
+        rstfile.add_links_and_tags(lambda tgt,reststem:None,add_linksto)
+    assert linksto == [(None,[]),('a1',['b1'])]*2
+
+def test_make_tgts_cache(monkeypatch):
+    '''
+    Tests that ``RstFile.make_tgts()`` scans the same lines once and keeps only a digest of them.
+
+    '''
+
+    scanned = []
+    scan = dcx._make_tgts_scan
+    monkeypatch.setattr(dcx,'_make_tgts_scan',lambda *a: scanned.append(a[1]) or scan(*a))
+    monkeypatch.setattr(dcx,'_make_tgts_cache',{})
+    monkeypatch.setattr(dcx,'_make_tgts_cache_max',2)
+    lns = ['.. _`c1`:','','C1 cached']
+    for doc in ['c.rest','c.rest','d.rest','e.rest']:
+        assert [t.target for t in RstFile.make_tgts(lns,doc)] == ['c1']
+    assert scanned == ['c.rest','d.rest','e.rest']
+    assert len(dcx._make_tgts_cache) == 2
+    assert all(lns[2] not in repr(k) for k in dcx._make_tgts_cache)
+
+def test_create_links():
+    '''
+    ``Tgt.create_links()`` creates the links of ``Tgt.create_link()`` for all link types.
+    '''
+    tgt = Tgt(0,'a1')
+    tgt.lnkname = 'A 1'
+    for reststem in ['../doc/a','']:
+        assert tgt.create_links(g_links_types,reststem) == [
+            tgt.create_link(linktype,reststem,
+                            linktype if linktype == 'sphinx' else 'pandoc')
+            for linktype in g_links_types]
+
 def test_dcx_regex():
     '''
     Test the regular expressions used in dcx.py.
@@ -162,6 +239,11 @@ def test_dcx_regex():
                               ) == ['', '../test.rst', '']
     assert rerstinclude.split('  .. include:: ../test.rst'
                               ) == ['  ', '../test.rst', '']
+    assert rexincimg.search('  .. include:: ../test.rst'
+                            ).group('inc') == '../test.rst'
+    assert rexincimg.search('.. |x y| image:: /tmp/img.png'
+                            ).group('img') == '/tmp/img.png'
+    assert rexincimg.search('.. |x| include:: test.rst') is None
     assert restplinclude.split('%include("test.rst.stpl",v="aparam")'
                                ) == ['', 'test.rst.stpl', '']
     assert restplinclude.split('%include("../test.rst.stpl",v="aparam")'
@@ -194,6 +276,15 @@ def tmpworkdir(tmpdir):
     yield tmpdir
     os.chdir(cwd)
 
+@pytest.yield_fixture(autouse=True)
+def keeprest():
+    """
+    Restore the main extension, which e.g. ``--rstrest`` tests change.
+    """
+    rest = dcx._rest
+    yield
+    dcx._set_rstrest(rest)
+
 @pytest.yield_fixture(params=[(0,'rest'),(0,'stpl'),(0,'ipdt'),(0,'over'),(1,'rest'),(1,'stpl'),(1,'ipdt'),(1,'over')])
 def rstinit(request, tmpworkdir):
     rR, smp = request.param
@@ -250,7 +341,7 @@ def test_rstincluded(rstinit):
         assert list(rstincluded(rR('ra.rest'),(r'./doc',))) == rR([
                 'ra.rest', '_links_sphinx.rst'])
         assert list(rstincluded(rR('sr.rest'),(r'./doc',))) == rR([
-                'sr.rest', '_links_sphinx.rst', '_links_sphinx.rst'])
+                'sr.rest', '_links_sphinx.rst'])
         assert list(rstincluded(rR('dd.rest'),(r'./doc',))) == rR([
                 'dd.rest', 'somefile.rst', '_links_sphinx.rst'])
         assert list(rstincluded(rR('tp.rest'),(r'./doc',))) == rR([
@@ -262,6 +353,43 @@ def test_rstincluded(rstinit):
     elif  initfor(rstinit,'over'):
         assert True
 
+def test_rstincluded_rst_toctree(tmpworkdir,monkeypatch):
+    '''
+    Tests that |dcx.rstincluded| follows ``.rst`` toctree entries with ``--rstrest``.
+
+    '''
+
+    monkeypatch.setattr(dcx,'_include_cache_dir',str(tmpworkdir.join('cache')))
+    os.mkdir('d')
+    with open('d/index.rst','w') as f:
+        f.write('.. toctree::\n\n   sr.rst\n   dd.rst\n')
+    for fn in ['d/sr.rst','d/dd.rst']:
+        with open(fn,'w') as f:
+            f.write('Title\n=====\n')
+    dcx._set_rstrest('.rst')
+    try:
+        d = str(tmpworkdir.join('d'))
+        assert list(rstincluded('index.rst',(d,),False,True)) == [
+            'index.rst','sr.rst','dd.rst']
+    finally:
+        dcx._set_rstrest('.rest')
+
+def test_rstincluded_cwd(tmpworkdir):
+    '''
+    Tests that |dcx.rstincluded| with relative paths depends on the current directory.
+
+    '''
+
+    for d, inc in [('a','x.rst'),('b','y.rst')]:
+        os.makedirs(d+'/doc')
+        with open(d+'/doc/m.rest','w') as f:
+            f.write('.. include:: %s\n'%inc)
+        with open(d+'/doc/'+inc,'w') as f:
+            f.write('Text\n')
+    for d, inc in [('a','x.rst'),('b','y.rst')]:
+        os.chdir(str(tmpworkdir.join(d)))
+        assert list(rstincluded('m.rest',('doc',))) == ['m.rest',inc]
+
 def test_init(rstinit):
     '''
     Tests the initialization of a sample directory tree
@@ -546,7 +674,7 @@ def test_dcx_in_out(rstinit,cmd_result):
             return
         else:
             tcmd = tcmd.replace('.stpl','')
-    r = subprocess.run(tcmd,shell=True,stdout=subprocess.PIPE)
+    r = run(tcmd,stdout=subprocess.PIPE)
     assert r.returncode == 0
     out = r.stdout.decode('utf-8')
     for res in result:
@@ -977,6 +1105,186 @@ def test_include_cmd(tmpworkdir,infile,outext):
     assert r.returncode == 0
     assert exists(infile+outext)
 
+def test_scan_cache(tmpworkdir,monkeypatch):
+    '''
+    Tests that ``Fldrs.scandirs()`` scans again only the folders with changed files.
+
+    '''
+
+    scanned = []
+    scan_fldr = dcx._scan_fldr
+    monkeypatch.setattr(dcx,'_scan_fldr',
+                        lambda *a: scanned.append(a[0]) or scan_fldr(*a))
+    def tgts():
+        fldrs = Fldrs('.',max_workers=1)
+        fldrs.scandirs()
+        return sorted(t for f in fldrs.values() for t in f.alltgts)
+    os.mkdir('a')
+    os.mkdir('b')
+    with open('a/a.rest','w') as f:
+        f.write('.. _`a1`:\n\nA1\n')
+    with open('b/b.rest','w') as f:
+        f.write('.. _`b1`:\n\nB1\n')
+    assert tgts() == ['a1','b1']
+    assert sorted(scanned) == ['a','b']
+    assert exists('.rstdcx-cache.json')
+    del scanned[:]
+    assert tgts() == ['a1','b1']
+    assert scanned == []
+    with open('b/b.rest','a') as f:
+        f.write('\n.. _`b2`:\n\nB2\n')
+    assert tgts() == ['a1','b1','b2']
+    assert scanned == ['b']
+    os.remove('.rstdcx-cache.json')
+    Fldrs('.',max_workers=1,cache=False).scandirs()
+    assert not exists('.rstdcx-cache.json')
+
+def test_scan_spawn(tmpworkdir,monkeypatch):
+    '''
+    Tests that spawned ``Fldrs.scandirs()`` workers scan with the ``_rest`` of the caller.
+
+    '''
+
+    import multiprocessing
+    monkeypatch.setattr(dcx,'_mp_context',lambda: multiprocessing.get_context('spawn'))
+    names = ['d%d'%i for i in range(dcx._parallel_scan_min)]
+    for d in names:
+        os.mkdir(d)
+        with open(d+'/'+d+'.rst','w') as f:
+            f.write('.. _`%s`:\n\n%s\n'%(d,d))
+    dcx._set_rstrest('.rst')
+    try:
+        fldrs = Fldrs('.',max_workers=2)
+        fldrs.scandirs()
+    finally:
+        dcx._set_rstrest('.rest')
+    assert sorted(t for f in fldrs.values() for t in f.alltgts) == names
+
+def test_gen_unchanged(tmpworkdir,monkeypatch):
+    '''
+    Tests that a touched, but unchanged source does not generate again.
+
+    '''
+
+    gened = []
+    gen = dcx.gen
+    monkeypatch.setattr(dcx,'gen',lambda *a,**kw: gened.append(a[0]) or gen(*a,**kw))
+    monkeypatch.setattr(dcx,'_include_cache_dir',str(tmpworkdir.join('cache')))
+    with open('src.py','w') as f:
+        f.write("#def gen_x(lns,**kw):\n"
+                "#  return [l.split('#@')[1] for l in rlines(r'^\\s*#@', lns)]\n"
+                "#def gen_x\n#@a line\n")
+    with open('gen','w') as f:
+        f.write('src.py | _x.rst | x | {}\n')
+    def touch(t):
+        t = time.time() + t
+        os.utime('src.py',(t,t))
+    dcx._gen_fldr('.')
+    assert len(gened) == 1
+    touch(5)
+    dcx._gen_fldr('.')
+    assert len(gened) == 1
+    with open('src.py','a') as f:
+        f.write('#@another line\n')
+    touch(10)
+    dcx._gen_fldr('.')
+    assert len(gened) == 2
+    assert open('_x.rst').read() == 'a line\nanother line\n'
+    stampfile = dcx._gen_stampfile('gen')
+    old = time.time() - dcx._include_cache_ttl - 10
+    os.utime(stampfile,(old,old))
+    dcx._gen_fldr('.')
+    assert os.stat(stampfile).st_mtime > old
+    os.utime(stampfile,(old,old))
+    monkeypatch.setattr(dcx,'_include_cache_pruned',[])
+    dcx._include_cache_prune()
+    assert not exists(stampfile)
+
+def test_dostpl_lookup(tmpworkdir):
+    '''
+    Tests that |dcx.dostpl| finds an include next to the template with a custom lookup.
+
+    '''
+
+    os.makedirs('d')
+    os.makedirs('o')
+    with open('d/t.rest.stpl','w') as f:
+        f.write('A\n% include("i.tpl")\n% include("j.tpl")\n')
+    with open('d/i.tpl','w') as f:
+        f.write('I\n')
+    with open('o/j.tpl','w') as f:
+        f.write('J\n')
+    for lookup in [[str(tmpworkdir.join('o'))],['../o']]:
+        assert dostpl('d/t.rest.stpl',lookup=lookup) == ['A\n','I\n','J\n']
+    os.symlink('d','l')
+    assert dostpl('l/t.rest.stpl',lookup=[str(tmpworkdir.join('l')),'../o']
+                  ) == ['A\n','I\n','J\n']
+
+def test_stat_session(tmpworkdir):
+    '''
+    Tests that a ``_stat_session()`` caches the stats of its own thread only.
+
+    '''
+
+    import threading
+    with dcx._stat_session():
+        assert not dcx._cached_exists('a')
+        with open('a','w') as f:
+            f.write('a\n')
+        assert not dcx._cached_exists('a')
+        res = []
+        t = threading.Thread(target=lambda: res.append(dcx._cached_exists('a')))
+        t.start()
+        t.join()
+        assert res == [True]
+    assert dcx._cached_exists('a')
+
+def test_write_if_changed(tmpworkdir):
+    '''
+    Tests that ``_write_if_changed()`` keeps an unchanged file and writes through a link.
+
+    '''
+
+    with open('t.rst','w') as f:
+        f.write('a\n')
+    os.chmod('t.rst',0o640)
+    os.symlink('t.rst','l.rst')
+    old = time.time() - 100
+    os.utime('t.rst',(old,old))
+    assert not dcx._write_if_changed('l.rst','a\n')
+    assert os.stat('t.rst').st_mtime == old
+    assert dcx._write_if_changed('l.rst','b\n')
+    assert os.path.islink('l.rst')
+    assert open('t.rst').read() == 'b\n'
+    assert os.stat('t.rst').st_mode & 0o777 == 0o640
+    assert sorted(os.listdir('.')) == ['l.rst','t.rst']
+
+def test_include_cache(tmpworkdir,monkeypatch):
+    '''
+    Tests that the include cache depends on ``_rest`` and drops expired entries.
+
+    '''
+
+    cache = str(tmpworkdir.join('cache'))
+    monkeypatch.setattr(dcx,'_include_cache_dir',cache)
+    with open('index.rst','w') as f:
+        f.write('.. toctree::\n\n   a.rest\n   b.rst\n')
+    try:
+        for rest, entry in [('.rest','a.rest'),('.rst','b.rst'),('.rest','a.rest')]:
+            dcx._set_rstrest(rest)
+            dcx._include_lines_cached.cache_clear()
+            fls = [fl for fl,kind,value in dcx._include_lines('index.rst') if fl]
+            assert fls == [entry]
+    finally:
+        dcx._set_rstrest('.rest')
+    assert len(os.listdir(cache)) == 2
+    old = time.time() - dcx._include_cache_ttl - 10
+    for fn in os.listdir(cache):
+        os.utime(os.path.join(cache,fn),(old,old))
+    monkeypatch.setattr(dcx,'_include_cache_pruned',[])
+    dcx._include_cache_prune()
+    assert os.listdir(cache) == []
+
 def test_pygrep():
     os.chdir(_a_fix(''))
     r = run(['rstdcx','--pygrep', 'inline'],stdout=subprocess.PIPE)